@@ -3,12 +3,21 @@ import pandas as pd
 from datetime import datetime, timedelta
 import urllib.parse
 import hashlib
-import plotly.express as px
-from collections import defaultdict
+import hmac
+import secrets
+import io
 from supabase import create_client, Client
 import json
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; stdlib json is used otherwise
+    orjson = None
 
 ##### FINAL CODE #####
 # Set page config
@@ -23,8 +32,18 @@ logging.basicConfig(level=logging.WARNING)
 
 # Constants
 CACHE_TTL = 300  # 5 minutes
+INVOICE_CACHE_TTL = 60  # Shorter TTL for invoices
 SEARCH_DEBOUNCE = 0.5  # 500ms
 MAX_DISPLAY_ITEMS = 50
+PASSWORD_HASH_SCHEME = 'pbkdf2_sha256'
+PASSWORD_HASH_ITERATIONS = 600_000  # OWASP's PBKDF2-HMAC-SHA256 guidance; older hashes are upgraded on login
+# Only the invoice columns the app reads, with the customer join
+INVOICE_COLUMNS = ('id, invoice_number, customer_id, date, total_amount, paid_amount, unpaid_amount, '
+                   'status, created_by, salesman, customers(name, phone)')
+INVOICE_FRAME_COLUMNS = ('invoice_number', 'date', 'customer_name', 'salesman', 'status',
+                         'total_amount', 'paid_amount', 'unpaid_amount')
+PRODUCT_CSV_COLUMNS = ('product', 'price', 'category', 'description')
+LOGO_PATH = Path(__file__).with_name("logo.jpg")  # Resolved once, independent of the working directory
 
 # Supabase configuration
 @st.cache_resource
@@ -39,10 +58,17 @@ def init_supabase():
 supabase: Client = init_supabase()
 
 # Add logo if exists
-try:
-    st.image("logo.jpg", width=150)
-except:
-    pass
+@st.cache_resource
+def load_logo():
+    """Read the logo once per process instead of from disk on every rerun"""
+    try:
+        return LOGO_PATH.read_bytes()
+    except OSError:
+        return None
+
+logo = load_logo()
+if logo:
+    st.image(logo, width=150)
 
 # Initialize session state efficiently
 def init_session_state():
@@ -52,9 +78,18 @@ def init_session_state():
         'current_user': None,
         'user_role': None,
         'cart': [],
+        'cart_version': 0,
+        'cart_totals': None,
         'show_payment_popup': False,
+        'flash_messages': [],
+        'last_invoice': None,
+        'pending_issued_at': None,
+        'saved_invoices': set(),
+        'whatsapp_links': {},
         'data_cache': {},
         'last_cache_update': {},
+        'derived_cache': {},
+        'bootstrapped': False,
         'search_cache': {},
         'last_search_time': {}
     }
@@ -65,6 +100,17 @@ def init_session_state():
 
 init_session_state()
 
+# Success messages that outlive st.rerun(), instead of sleeping so they can be read first
+def flash(message):
+    """Queue a success message to show after the next rerun"""
+    st.session_state.flash_messages.append(message)
+
+def show_flash_messages():
+    """Show and clear the queued success messages"""
+    for message in st.session_state.flash_messages:
+        st.success(message)
+    st.session_state.flash_messages = []
+
 # Optimized Database Functions with Caching
 class OptimizedDatabaseManager:
     def __init__(self, supabase_client):
@@ -103,6 +149,31 @@ class OptimizedDatabaseManager:
             st.error(f"Database error: {e}")
             return []
     
+    def _prepend_cached(self, cache_key, row):
+        """Add a freshly inserted row to a cached result instead of refetching it"""
+        if cache_key in st.session_state.data_cache:
+            st.session_state.data_cache[cache_key] = [row] + st.session_state.data_cache[cache_key]
+    
+    def _append_cached(self, cache_key, row):
+        """Add a freshly inserted row to the end of a cached result instead of refetching it"""
+        if cache_key in st.session_state.data_cache:
+            st.session_state.data_cache[cache_key] = st.session_state.data_cache[cache_key] + [row]
+    
+    def _remove_cached(self, table_name, keep):
+        """Drop deleted rows from every cached result of a table instead of refetching it"""
+        for key in [k for k in st.session_state.data_cache if k.startswith(table_name)]:
+            st.session_state.data_cache[key] = [row for row in st.session_state.data_cache[key] if keep(row)]
+    
+    def _derive(self, cache_key, source, build):
+        """Memoize a structure built from cached rows until those rows are refetched"""
+        cached = st.session_state.derived_cache.get(cache_key)
+        if cached is not None and cached[0] is source:
+            return cached[1]
+        
+        value = build(source)
+        st.session_state.derived_cache[cache_key] = (source, value)
+        return value
+    
     def invalidate_cache(self, table_name=None):
         """Invalidate cache for specific table or all tables"""
         if table_name:
@@ -115,6 +186,31 @@ class OptimizedDatabaseManager:
             st.session_state.data_cache.clear()
             st.session_state.last_cache_update.clear()
     
+    def prefetch(self, created_by=None):
+        """Warm the cache for the main app tables with concurrent requests"""
+        requests = [
+            (self._get_cache_key('salesmen'), self._fetch_salesmen, CACHE_TTL),
+            (self._get_cache_key('customers'), self._fetch_customers, CACHE_TTL),
+            (self._get_cache_key('products', {'active_only': True}), self._fetch_products, CACHE_TTL),
+            (self._get_cache_key('invoices', {'created_by': created_by}),
+             lambda: self._fetch_invoices(created_by), INVOICE_CACHE_TTL),
+        ]
+        pending = [(key, fetch) for key, fetch, ttl in requests if not self._is_cache_valid(key, ttl)]
+        if not pending:
+            return
+        
+        # Supabase calls are IO-bound, so threads overlap their latency; the
+        # fetch functions only touch the client, never st.session_state
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = {key: executor.submit(fetch) for key, fetch in pending}
+        
+        for key, future in futures.items():
+            try:
+                self._cache_data(key, future.result())
+            except Exception as e:
+                # Leave the entry uncached so the regular getter retries and reports it
+                logging.warning(f"Prefetch failed for {key}: {e}")
+    
     # Salesmen operations
     def get_salesmen(self, use_cache=True):
         """Get all salesmen from database with caching"""
@@ -123,18 +219,22 @@ class OptimizedDatabaseManager:
         if not use_cache:
             self.invalidate_cache('salesmen')
         
-        def fetch_salesmen():
-            response = self.supabase.table('salesmen').select('*').execute()
-            return response.data or []
-        
-        return self._get_cached_or_fetch(cache_key, fetch_salesmen)
+        return self._get_cached_or_fetch(cache_key, self._fetch_salesmen)
+    
+    def _fetch_salesmen(self):
+        """Query all salesmen"""
+        response = self.supabase.table('salesmen').select('*').execute()
+        return response.data or []
     
     def add_salesman(self, salesman_data):
         """Add new salesman to database"""
         try:
             response = self.supabase.table('salesmen').insert(salesman_data).execute()
-            self.invalidate_cache('salesmen')
-            return response.data[0] if response.data else None
+            if not response.data:
+                self.invalidate_cache('salesmen')
+                return None
+            self._append_cached(self._get_cache_key('salesmen'), response.data[0])
+            return response.data[0]
         except Exception as e:
             st.error(f"Error adding salesman: {e}")
             return None
@@ -167,26 +267,94 @@ class OptimizedDatabaseManager:
         if not use_cache:
             self.invalidate_cache('customers')
         
-        def fetch_customers():
-            response = self.supabase.table('customers').select('*').order('created_date', desc=True).execute()
-            return response.data or []
+        return self._get_cached_or_fetch(cache_key, self._fetch_customers)
+    
+    def _fetch_customers(self):
+        """Query all customers, newest first"""
+        response = self.supabase.table('customers').select('*').order('created_date', desc=True).execute()
+        return response.data or []
+    
+    def get_salesmen_by_username(self):
+        """Get a username -> salesman dict, built once per salesmen fetch"""
+        return self._derive('salesmen_by_username', self.get_salesmen(),
+                            lambda salesmen: {s['username']: s for s in salesmen})
+    
+    def get_salesman_rows(self):
+        """Get display rows for the salesmen table, built once per salesmen fetch"""
+        def build_rows(salesmen):
+            return [
+                {
+                    'Name': s['name'],
+                    'Username': s['username'],
+                    'Role': s['role'].title(),
+                    'Status': "🟢 Active" if s['active'] else "🔴 Inactive",
+                    'Created': datetime.fromisoformat(s['created_date']).strftime('%Y-%m-%d')
+                }
+                for s in salesmen
+            ]
         
-        return self._get_cached_or_fetch(cache_key, fetch_customers)
+        return self._derive('salesman_rows', self.get_salesmen(), build_rows)
     
     def add_customer(self, customer_data):
         """Add new customer to database"""
         try:
             response = self.supabase.table('customers').insert(customer_data).execute()
-            self.invalidate_cache('customers')
-            return response.data[0] if response.data else None
+            if not response.data:
+                self.invalidate_cache('customers')
+                return None
+            # Newest first, matching the fetch order, without refetching the whole table
+            self._prepend_cached(self._get_cache_key('customers'), response.data[0])
+            return response.data[0]
         except Exception as e:
             st.error(f"Error adding customer: {e}")
             return None
     
+    def get_customer_index(self):
+        """Get sets of lowercased customer names and phones for duplicate checks"""
+        def build_index(customers):
+            return {c['name'].lower() for c in customers}, {c['phone'] for c in customers}
+        
+        return self._derive('customer_index', self.get_customers(), build_index)
+    
+    def get_customer_catalog(self):
+        """Get customer ids, their display labels and an id lookup dict"""
+        def build_catalog(customers):
+            ids = tuple(c['id'] for c in customers)
+            labels = {c['id']: f"{c['name']} - {c['phone']}" for c in customers}
+            by_id = {c['id']: c for c in customers}
+            return ids, labels, by_id
+        
+        return self._derive('customer_catalog', self.get_customers(), build_catalog)
+    
+    def search_customers(self, search_term):
+        """Get ids of customers whose name or phone contains the search term, case-insensitively"""
+        def build_search_keys(customers):
+            # One lowercased "name\nphone" string per customer; the newline keeps matches within a field
+            return tuple((c['id'], f"{c['name'] or ''}\n{c['phone'] or ''}".lower()) for c in customers)
+        
+        search_keys = self._derive('customer_search_keys', self.get_customers(), build_search_keys)
+        search_lower = search_term.lower()
+        return [customer_id for customer_id, key in search_keys if search_lower in key]
+    
+    def get_customer_rows(self):
+        """Get display rows for the customers table keyed by customer id"""
+        def build_rows(customers):
+            return {
+                c['id']: {
+                    'Name': c['name'],
+                    'Phone': c['phone'],
+                    'Email': c.get('email', ''),
+                    'Created': datetime.fromisoformat(c['created_date']).strftime('%Y-%m-%d')
+                }
+                for c in customers
+            }
+        
+        return self._derive('customer_rows', self.get_customers(), build_rows)
+    
     def get_customer_by_id(self, customer_id):
         """Get customer by ID with caching"""
-        customers = self.get_customers()
-        return next((c for c in customers if c['id'] == customer_id), None)
+        _, _, customers_by_id = self.get_customer_catalog()
+        return customers_by_id.get(customer_id)
     
     # Invoice operations
     def get_invoices(self, created_by=None, use_cache=True):
@@ -196,26 +364,98 @@ class OptimizedDatabaseManager:
         if not use_cache:
             self.invalidate_cache('invoices')
         
-        def fetch_invoices():
-            query = (
-                self.supabase
-                .table('invoices')
-                .select('*, customers(*)')
-                .order('date', desc=True)
+        return self._get_cached_or_fetch(cache_key, lambda: self._fetch_invoices(created_by), ttl=INVOICE_CACHE_TTL)
+    
+    def _fetch_invoices(self, created_by=None):
+        """Query invoices with their customer, optionally for one creator"""
+        query = (
+            self.supabase
+            .table('invoices')
+            .select(INVOICE_COLUMNS)
+            .order('date', desc=True)
+        )
+        if created_by:
+            query = query.eq('created_by', created_by)
+        response = query.execute()
+        return [self._flatten_invoice(row) for row in response.data or []]
+    
+    @staticmethod
+    def _flatten_invoice(row):
+        """Replace the nested customers join with flat customer_name/customer_phone keys and set owner and status icon"""
+        customer = row.pop('customers', None) or {}
+        row['customer_name'] = customer.get('name') or ''
+        row['customer_phone'] = customer.get('phone') or ''
+        # created_by is what per-user queries filter on; salesman is the fallback for imported rows
+        row['owner'] = row.get('created_by') or row.get('salesman')
+        row['status_icon'] = invoice_status_icon(row['status'])
+        return row
+    
+    def get_invoice_summary(self, created_by=None):
+        """Get (sales, paid, unpaid, count) totals, computed once per invoice fetch"""
+        return self._derive(f"invoice_summary_{created_by}", self.get_invoices(created_by), summarize_invoices)
+    
+    def search_invoices(self, search_term, status_filter=None, created_by=None):
+        """Get invoices matching a status and an invoice number or customer name substring"""
+        def build_search_keys(invoices):
+            # One lowercased "number\nname" string per invoice, aligned with the cached list
+            return tuple(f"{inv['invoice_number']}\n{inv['customer_name']}".lower() for inv in invoices)
+        
+        invoices = self.get_invoices(created_by)
+        search_keys = self._derive(f"invoice_search_keys_{created_by}", invoices, build_search_keys)
+        search_lower = search_term.lower()
+        return [
+            inv for inv, key in zip(invoices, search_keys)
+            if search_lower in key and (not status_filter or status_filter in inv['status'])
+        ]
+    
+    def get_invoice_frame(self):
+        """Get all invoices as a typed DataFrame for analytics, built once per invoice fetch"""
+        def build_frame(invoices):
+            df = pd.DataFrame(invoices, columns=INVOICE_FRAME_COLUMNS)
+            df['date'] = parse_invoice_dates(df['date'])
+            # Low-cardinality text as categories; amounts stay float64 so cents do not drift
+            return df.astype({'status': 'category', 'salesman': 'category'})
+        
+        return self._derive('invoice_frame', self.get_invoices(), build_frame)
+    
+    def get_invoice_analytics(self, since):
+        """Get the analytics tab aggregates, computed once per invoice fetch and start date"""
+        def build_analytics(df):
+            recent_df = df[df['date'] >= since]
+            salesman_performance = (
+                recent_df.groupby('salesman', observed=True)[['total_amount', 'paid_amount']].sum()
+                .round(2).reset_index()
+                .sort_values('total_amount', ascending=False)
             )
-            if created_by:
-                query = query.eq('created_by', created_by)
-            response = query.execute()
-            return response.data or []
+            total_revenue = df['total_amount'].sum()
+            total_collected = df['paid_amount'].sum()
+            return {
+                'daily_sales': recent_df.groupby('date')['total_amount'].sum(),
+                'salesman_performance': salesman_performance,
+                'status_counts': df['status'].value_counts(),
+                'total_revenue': total_revenue,
+                'total_collected': total_collected,
+                'collection_rate': (total_collected / total_revenue * 100) if total_revenue > 0 else 0,
+                'avg_invoice': df['total_amount'].mean()
+            }
         
-        return self._get_cached_or_fetch(cache_key, fetch_invoices, ttl=60)  # Shorter TTL for invoices
+        return self._derive(f"invoice_analytics_{since:%Y%m%d}", self.get_invoice_frame(), build_analytics)
     
     def add_invoice(self, invoice_data):
         """Add new invoice to database"""
         try:
             response = self.supabase.table('invoices').insert(invoice_data).execute()
-            self.invalidate_cache('invoices')
-            return response.data[0] if response.data else None
+            if not response.data:
+                self.invalidate_cache('invoices')
+                return None
+            
+            # Fill in the joined customer fields from the cached customers, then add the
+            # invoice to the all-invoices list and its creator's list (newest first)
+            customer = self.get_customer_by_id(response.data[0]['customer_id']) or {}
+            invoice = self._flatten_invoice({**response.data[0], 'customers': customer})
+            for created_by in {None, invoice.get('created_by')}:
+                self._prepend_cached(self._get_cache_key('invoices', {'created_by': created_by}), invoice)
+            return invoice
         except Exception as e:
             st.error(f"Error adding invoice: {e}")
             return None
@@ -224,7 +464,7 @@ class OptimizedDatabaseManager:
         """Delete invoice from database"""
         try:
             response = self.supabase.table('invoices').delete().eq('invoice_number', invoice_number).execute()
-            self.invalidate_cache('invoices')
+            self._remove_cached('invoices', lambda row: row['invoice_number'] != invoice_number)
             return True
         except Exception as e:
             st.error(f"Error deleting invoice: {e}")
@@ -240,20 +480,48 @@ class OptimizedDatabaseManager:
             for key in keys_to_remove:
                 del st.session_state.data_cache[key]
         
-        def fetch_items():
-            response = self.supabase.table('invoice_items').select('*').eq('invoice_id', invoice_id).execute()
-            return response.data or []
+        return self._get_cached_or_fetch(cache_key, lambda: self._fetch_invoice_items(invoice_id))
+    
+    def _fetch_invoice_items(self, invoice_id):
+        """Query the items of one invoice"""
+        response = self.supabase.table('invoice_items').select('*').eq('invoice_id', invoice_id).execute()
+        return response.data or []
+    
+    def get_invoice_items_bulk(self, invoice_ids):
+        """Get items for several invoices with a single query, reusing cached entries"""
+        items_by_invoice = {}
+        missing_ids = []
+        for invoice_id in invoice_ids:
+            cache_key = self._get_cache_key('invoice_items', {'invoice_id': invoice_id})
+            if self._is_cache_valid(cache_key):
+                items_by_invoice[invoice_id] = st.session_state.data_cache[cache_key]
+            else:
+                missing_ids.append(invoice_id)
+        
+        if missing_ids:
+            try:
+                response = self.supabase.table('invoice_items').select('*').in_('invoice_id', missing_ids).execute()
+                fetched = {invoice_id: [] for invoice_id in missing_ids}
+                for item in response.data or []:
+                    fetched.setdefault(item['invoice_id'], []).append(item)
+                for invoice_id, items in fetched.items():
+                    self._cache_data(self._get_cache_key('invoice_items', {'invoice_id': invoice_id}), items)
+                items_by_invoice.update(fetched)
+            except Exception as e:
+                st.error(f"Database error: {e}")
         
-        return self._get_cached_or_fetch(cache_key, fetch_items)
+        return items_by_invoice
     
     def add_invoice_items(self, items_data):
-        """Add multiple invoice items"""
+        """Add the items of a newly created invoice"""
         try:
             response = self.supabase.table('invoice_items').insert(items_data).execute()
-            # Invalidate invoice items cache
-            keys_to_remove = [k for k in st.session_state.data_cache.keys() if k.startswith('invoice_items')]
-            for key in keys_to_remove:
-                del st.session_state.data_cache[key]
+            # Cache the inserted rows directly instead of dropping every cached invoice's items
+            items_by_invoice = {}
+            for item in response.data or []:
+                items_by_invoice.setdefault(item['invoice_id'], []).append(item)
+            for invoice_id, items in items_by_invoice.items():
+                self._cache_data(self._get_cache_key('invoice_items', {'invoice_id': invoice_id}), items)
             return response.data
         except Exception as e:
             st.error(f"Error adding invoice items: {e}")
@@ -267,14 +535,33 @@ class OptimizedDatabaseManager:
         if not use_cache:
             self.invalidate_cache('products')
         
-        def fetch_products():
-            query = self.supabase.table('products').select('*')
-            if active_only:
-                query = query.eq('active', True)
-            response = query.order('product').execute()
-            return response.data or []
+        return self._get_cached_or_fetch(cache_key, lambda: self._fetch_products(active_only))
+    
+    def get_product_catalog(self):
+        """Get active product names, their display labels and a name lookup dict"""
+        def build_catalog(products):
+            names = tuple(p['product'] for p in products)
+            labels = {
+                p['product']: f"{p['product']} ({p['category']})" if p.get('category') else p['product']
+                for p in products
+            }
+            by_name = {p['product']: p for p in products}
+            return names, labels, by_name
         
-        return self._get_cached_or_fetch(cache_key, fetch_products)
+        return self._derive('product_catalog', self.get_products(), build_catalog)
+    
+    def get_product_name_index(self):
+        """Get the set of lowercased names of all products (active or not) for duplicate checks"""
+        return self._derive('product_name_index', self.get_products(active_only=False),
+                            lambda products: {p['product'].lower() for p in products})
+    
+    def _fetch_products(self, active_only=True):
+        """Query products ordered by name"""
+        query = self.supabase.table('products').select('*')
+        if active_only:
+            query = query.eq('active', True)
+        response = query.order('product').execute()
+        return response.data or []
     
     def add_product(self, product_data):
         """Add new product to database"""
@@ -323,10 +610,52 @@ class OptimizedDatabaseManager:
 # Initialize optimized database manager
 db = OptimizedDatabaseManager(supabase)
 
-# Hash password function
-@st.cache_data
+# JSON helpers, using orjson when it is installed
+def dumps_json(obj):
+    """Serialize an object to a JSON string"""
+    return orjson.dumps(obj).decode() if orjson else json.dumps(obj)
+
+def loads_json(data):
+    """Parse a JSON string"""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+# Password hashing: salted PBKDF2 stored as "pbkdf2_sha256$iterations$salt$hash"
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash a password with a fresh random salt"""
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), PASSWORD_HASH_ITERATIONS)
+    return f"{PASSWORD_HASH_SCHEME}${PASSWORD_HASH_ITERATIONS}${salt}${digest.hex()}"
+
+def verify_password(stored_hash, password):
+    """Check a password against a stored hash in constant time, accepting legacy unsalted SHA-256"""
+    try:
+        if stored_hash.startswith(PASSWORD_HASH_SCHEME + '$'):
+            _, iterations, salt, expected = stored_hash.split('$')
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), int(iterations)).hex()
+        else:
+            expected, digest = stored_hash, hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(digest, expected)
+    except (AttributeError, TypeError, ValueError):
+        # Missing or malformed stored hash: never a match
+        return False
+
+# Checked when the username is unknown, so a miss costs the same PBKDF2 work as a wrong password
+UNKNOWN_USER_PASSWORD_HASH = f"{PASSWORD_HASH_SCHEME}${PASSWORD_HASH_ITERATIONS}${'0' * 32}${'0' * 64}"
+
+def password_needs_rehash(stored_hash):
+    """Whether a stored hash predates the current scheme or iteration count"""
+    return not stored_hash.startswith(f"{PASSWORD_HASH_SCHEME}${PASSWORD_HASH_ITERATIONS}$")
+
+def authenticate(username, password):
+    """Return the active salesman matching the credentials, or None"""
+    user = db.get_salesmen_by_username().get(username)
+    password_ok = verify_password(user['password'] if user else UNKNOWN_USER_PASSWORD_HASH, password)
+    if not (user and password_ok and user['active']):
+        return None
+    # Upgrade legacy and lower-iteration hashes on the first successful login
+    if password_needs_rehash(user['password']):
+        db.update_salesman(user['id'], {'password': hash_password(password)})
+    return user
 
 # Optimized search with debouncing
 def debounced_search(search_term, search_type):
@@ -342,8 +671,11 @@ def debounced_search(search_term, search_type):
     
     return cache_key in st.session_state.search_cache
 
-# Initialize default admin if no salesmen exist
+# Initialize default admin if no salesmen exist (once per session, not on every rerun)
 def initialize_default_admin():
+    if st.session_state.bootstrapped:
+        return
+    
     salesmen = db.get_salesmen()
     if not salesmen:
         default_admin = {
@@ -355,6 +687,8 @@ def initialize_default_admin():
             'active': True
         }
         db.add_salesman(default_admin)
+    
+    st.session_state.bootstrapped = True
 
 # Optimized login function
 def login_page():
@@ -371,11 +705,7 @@ def login_page():
         login_button = st.form_submit_button("Login", type="primary")
         
         if login_button:
-            # Check against salesmen database
-            hashed_password = hash_password(password)
-            salesmen = db.get_salesmen()
-            user = next((s for s in salesmen 
-                        if s['username'] == username and s['password'] == hashed_password and s['active']), None)
+            user = authenticate(username, password)
             
             if user:
                 st.session_state.authenticated = True
@@ -389,43 +719,68 @@ def login_page():
     st.markdown("---")
     st.markdown("*Secure Invoice Management System*")
 
-# Optimized product loading with caching
-@st.cache_data(ttl=CACHE_TTL)
-def load_products_cached():
-    """Load products from database with Streamlit caching"""
-    try:
-        products = db.get_products()
-        if products:
-            return pd.DataFrame(products)
-        else:
-            return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Error loading products: {e}")
-        return pd.DataFrame()
+@st.cache_data(show_spinner=False)
+def parse_products_csv(csv_bytes):
+    """Parse products CSV content once per distinct file, keeping only known columns.
+    
+    Returns the products and the rows whose price is not a number (with their 1-based data row numbers).
+    """
+    df = pd.read_csv(
+        io.BytesIO(csv_bytes),
+        encoding='utf-8-sig',  # Spreadsheet exports prepend a BOM to the header
+        usecols=lambda column: column in PRODUCT_CSV_COLUMNS,
+        dtype={'product': 'string', 'price': 'string'},
+        keep_default_na=False, na_values=['']  # Only empty cells are missing; "N/A" prices get reported
+    )
+    if 'price' not in df.columns:
+        return df, pd.DataFrame(columns=['row', 'product', 'price'])
+    
+    # Prices are read as text so one bad value ("12,5", "N/A") cannot fail the whole file
+    price_text = df['price'].str.strip()
+    df['price'] = pd.to_numeric(price_text, errors='coerce')
+    invalid = df['price'].isna() & price_text.notna() & (price_text != '')
+    invalid_prices = pd.DataFrame({
+        # Data rows, not file lines: blank lines and multiline quoted cells would throw line numbers off
+        'row': df.index[invalid] + 1,
+        'product': df.loc[invalid, 'product'] if 'product' in df.columns else pd.NA,
+        'price': price_text[invalid]
+    })
+    return df, invalid_prices
+
+def describe_invalid_prices(invalid_prices, limit=5):
+    """Summarize rows with a non-numeric price for a warning message"""
+    shown = ", ".join(f"row {row} ({price!r})" for row, price in
+                      zip(invalid_prices['row'][:limit], invalid_prices['price'][:limit]))
+    more = f" and {len(invalid_prices) - limit} more" if len(invalid_prices) > limit else ""
+    return f"{len(invalid_prices)} row(s) have a price that is not a number and are skipped: {shown}{more}"
 
 def load_products_from_csv(csv_file_path=None, uploaded_file=None):
     """Load products from CSV file and save to database"""
     try:
         if uploaded_file:
-            df = pd.read_csv(uploaded_file)
+            df, invalid_prices = parse_products_csv(uploaded_file.getvalue())
         elif csv_file_path:
-            df = pd.read_csv(csv_file_path)
+            with open(csv_file_path, 'rb') as f:
+                df, invalid_prices = parse_products_csv(f.read())
         else:
             return False, "No file provided"
         
         if 'product' not in df.columns or 'price' not in df.columns:
             return False, "CSV must contain 'product' and 'price' columns"
         
+        # Rows with a missing or non-numeric price are skipped and counted in the result message
+        df = df.dropna(subset=['product', 'price'])
+        invalid_note = f" {describe_invalid_prices(invalid_prices)}." if not invalid_prices.empty else ""
+        
         # Prepare products for database insertion
         products_to_add = []
-        existing_products = db.get_products(active_only=False)
-        existing_product_names = [p['product'].lower() for p in existing_products]
+        existing_product_names = db.get_product_name_index()
         
         added_count = 0
         skipped_count = 0
         
-        for _, row in df.iterrows():
-            product_name = str(row['product']).strip()
+        for product, price in zip(df['product'], df['price']):
+            product_name = str(product).strip()
             
             # Skip if product already exists
             if product_name.lower() in existing_product_names:
@@ -434,7 +789,7 @@ def load_products_from_csv(csv_file_path=None, uploaded_file=None):
             
             product_data = {
                 'product': product_name,
-                'price': float(row['price'])
+                'price': float(price)
             }
             products_to_add.append(product_data)
             added_count += 1
@@ -442,61 +797,198 @@ def load_products_from_csv(csv_file_path=None, uploaded_file=None):
         if products_to_add:
             result = db.bulk_add_products(products_to_add)
             if result:
-                # Clear cache after adding products
-                st.cache_data.clear()
-                return True, f"Successfully added {added_count} products. Skipped {skipped_count} duplicates."
+                # bulk_add_products already invalidated the product queries; the parsed CSV stays cached
+                return True, f"Successfully added {added_count} products. Skipped {skipped_count} duplicates.{invalid_note}"
             else:
                 return False, "Failed to add products to database"
         else:
-            return True, f"No new products to add. Skipped {skipped_count} existing products."
+            return True, f"No new products to add. Skipped {skipped_count} existing products.{invalid_note}"
             
     except Exception as e:
         return False, f"Error processing CSV: {str(e)}"
 
-# Optimized WhatsApp generation
-@st.cache_data
-def generate_whatsapp_invoice_text(customer_name, customer_phone, cart_items_str, invoice_number, paid):
-    """Generate WhatsApp formatted invoice text with caching"""
-    cart_items = eval(cart_items_str)  # Convert string back to list for caching
-    total_amount = sum(item['quantity'] * item['price'] for item in cart_items)
+def cart_line_totals(cart_items):
+    """Compute each line's subtotal once and the cart total from those subtotals"""
+    line_totals = [item['quantity'] * item['price'] for item in cart_items]
+    return line_totals, sum(line_totals)
+
+def get_cart_totals():
+    """Get the cart's line subtotals and total, recomputed only when the cart version changes"""
+    cached = st.session_state.cart_totals
+    if cached is None or cached[0] != st.session_state.cart_version:
+        cached = (st.session_state.cart_version, *cart_line_totals(st.session_state.cart))
+        st.session_state.cart_totals = cached
+    return cached[1], cached[2]
+
+# Cart button callbacks run before the rerun the click triggers, so no explicit st.rerun() is needed
+def add_to_cart():
+    """Add the selected product line to the cart"""
+    # Read the widgets at click time; args bound at render would carry the previous run's choice
+    _, _, products_by_name = db.get_product_catalog()
+    product = products_by_name[st.session_state.cart_product]
+    quantity = st.session_state.cart_quantity
+    if st.session_state.pending_issued_at is None:
+        # The invoice number is fixed when the cart starts, so a repeated confirm maps to the same invoice
+        st.session_state.pending_issued_at = datetime.now()
+    st.session_state.cart.append({
+        'product': product['product'],
+        'price': float(product['price']),
+        'quantity': quantity
+    })
+    st.session_state.cart_version += 1
+    flash(f"Added {quantity}x {product['product']} to cart")
 
-    # Create formatted invoice text
-    invoice_text = f"""*Thank you for visiting the Third Stationery Exhibition*
+def clear_cart():
+    """Remove every line from the cart"""
+    st.session_state.cart = []
+    st.session_state.cart_version += 1
+    st.session_state.pending_issued_at = None
+
+def close_payment_popup():
+    """Hide the payment form without creating an invoice"""
+    st.session_state.show_payment_popup = False
+
+def dismiss_last_invoice():
+    """Stop showing the last created invoice's WhatsApp link"""
+    st.session_state.last_invoice = None
+
+def clear_invoice_history_selection():
+    """Forget the selected invoice history row, whose index no longer matches the filtered list"""
+    st.session_state.pop("invoice_history_table", None)
+
+def apply_cart_edits(editor_key):
+    """Apply quantity changes and removals from the cart editor back to the cart"""
+    edits = st.session_state[editor_key]
+    cart = st.session_state.cart
+    removed = set(edits['deleted_rows'])
+    
+    for row, changes in edits['edited_rows'].items():
+        if changes.get('Remove'):
+            removed.add(row)
+        elif changes.get('Quantity'):
+            cart[row]['quantity'] = int(changes['Quantity'])
+    
+    if removed:
+        st.session_state.cart = [item for i, item in enumerate(cart) if i not in removed]
+    
+    # A fresh editor key drops the edits that have just been applied, and the cart totals are recomputed
+    st.session_state.cart_version += 1
+
+# Characters that Streamlit markdown would treat as formatting ($ starts LaTeX)
+MARKDOWN_ESCAPE_TABLE = str.maketrans({ch: '\\' + ch for ch in '\\`*_[]<>#$~|'})
+
+def escape_markdown(text):
+    """Escape user-entered text for markdown in a single translate pass"""
+    return str(text).translate(MARKDOWN_ESCAPE_TABLE)
+
+# WhatsApp invoice templates, built once at import and filled per invoice
+WHATSAPP_HEADER_TEMPLATE = """*Thank you for visiting the Third Stationery Exhibition*
 
 *INVOICE #{invoice_number}*
-Date: {datetime.now().strftime("%Y-%m-%d %H:%M")}
+Date: {date}
 
 *BILL TO*
 ━━━━━━━━━━━━━━━━━━
 Name: {customer_name}
-Phone: {customer_phone}"""
+Phone: {customer_phone}
+
+*ITEMS*
+━━━━━━━━━━━━━━━━━━
+"""
+
+WHATSAPP_ITEM_TEMPLATE = "{index}. {product}\n   Qty: {quantity} × ${price:.2f}\n   Subtotal: ${subtotal:.2f}\n\n"
+
+WHATSAPP_FOOTER_TEMPLATE = """━━━━━━━━━━━━━━━━━━
+TOTAL: ${total_amount:.2f}
+━━━━━━━━━━━━━━━━━━
+
+*PAID: ${paid:.2f}*
+━━━━━━━━━━━━━━━━━━
+
+Generated on {generated_on}
+
+Best regards,
+*The Muslim Scout - Bara ibn Malik Troop*"""
 
-    invoice_text += "\n\n*ITEMS*\n━━━━━━━━━━━━━━━━━━\n"
+# Optimized WhatsApp generation (cart passed as a JSON string: one cheap hash for the cache key)
+@st.cache_data(show_spinner=False)
+def whatsapp_invoice_items(cart_items_str):
+    """Format the item lines and total of a WhatsApp invoice"""
+    cart_items = loads_json(cart_items_str)  # Convert string back to list for caching
+    line_totals, total_amount = cart_line_totals(cart_items)
+    item_lines = [
+        WHATSAPP_ITEM_TEMPLATE.format(
+            index=i,
+            product=item['product'],
+            quantity=item['quantity'],
+            price=item['price'],
+            subtotal=line_total
+        )
+        for i, (item, line_total) in enumerate(zip(cart_items, line_totals), 1)
+    ]
+    return "".join(item_lines), total_amount
 
-    for i, item in enumerate(cart_items, 1):
-        item_total = item['quantity'] * item['price']
-        invoice_text += f"{i}. {item['product']}\n"
-        invoice_text += f"   Qty: {item['quantity']} × ${item['price']:.2f}\n"
-        invoice_text += f"   Subtotal: ${item_total:.2f}\n\n"
+def generate_whatsapp_invoice_text(customer_name, customer_phone, cart_items_str, invoice_number, paid, issued_at):
+    """Generate WhatsApp formatted invoice text"""
+    # Only the items are cached: the timestamp differs on nearly every call and would make each one a miss
+    items_text, total_amount = whatsapp_invoice_items(cart_items_str)
+    issued_on = issued_at.strftime("%Y-%m-%d %H:%M")  # Formatted once for header and footer
 
-    invoice_text += "━━━━━━━━━━━━━━━━━━\n"
-    invoice_text += f"TOTAL: ${total_amount:.2f}\n"
-    invoice_text += "━━━━━━━━━━━━━━━━━━\n\n"
-    invoice_text += f"*PAID: ${paid:.2f}*\n"
-    invoice_text += "━━━━━━━━━━━━━━━━━━\n\n"
-    invoice_text += f"Generated on {datetime.now().strftime('%Y-%m-%d at %H:%M')}\n\n"
-    invoice_text += "Best regards,\n*The Muslim Scout - Bara ibn Malik Troop*"
+    header = WHATSAPP_HEADER_TEMPLATE.format(
+        invoice_number=invoice_number,
+        date=issued_on,
+        customer_name=customer_name,
+        customer_phone=customer_phone
+    )
+    footer = WHATSAPP_FOOTER_TEMPLATE.format(
+        total_amount=total_amount,
+        paid=paid,
+        generated_on=issued_on.replace(' ', ' at ', 1)
+    )
+
+    # Join once instead of growing the string item by item
+    invoice_text = "".join([header, items_text, footer])
 
     return invoice_text, total_amount
 
+class DigitsOnlyTable(dict):
+    """str.translate table that keeps digits and drops everything else, filled lazily per character"""
+    def __missing__(self, codepoint):
+        value = codepoint if chr(codepoint).isdigit() else None
+        self[codepoint] = value
+        return value
+
+PHONE_DIGITS_TABLE = DigitsOnlyTable()
+
 # Create WhatsApp link with formatted invoice text
-@st.cache_data
+@st.cache_data(show_spinner=False)
 def create_whatsapp_link(phone, invoice_text):
-    clean_phone = ''.join(filter(str.isdigit, phone))
-    encoded_message = urllib.parse.quote(invoice_text)
+    clean_phone = phone.translate(PHONE_DIGITS_TABLE)
+    # Encode once and quote the bytes directly; same output as quote(), minus its str dispatch
+    encoded_message = urllib.parse.quote_from_bytes(invoice_text.encode('utf-8'))
     whatsapp_url = f"https://wa.me/{clean_phone}?text={encoded_message}"
     return whatsapp_url
 
+def invoice_whatsapp_link(invoice, invoice_items):
+    """Get the WhatsApp link for a saved invoice, building it only once per session"""
+    links = st.session_state.whatsapp_links
+    if invoice['invoice_number'] not in links:
+        # Reconstruct cart items for WhatsApp message
+        cart_items = [
+            {'product': item['product'], 'price': item['price'], 'quantity': item['quantity']}
+            for item in invoice_items
+        ]
+        invoice_text, _ = generate_whatsapp_invoice_text(
+            invoice['customer_name'],
+            invoice['customer_phone'],
+            dumps_json(cart_items),
+            invoice['invoice_number'],
+            invoice['paid_amount'],
+            datetime.now().replace(second=0, microsecond=0)
+        )
+        links[invoice['invoice_number']] = create_whatsapp_link(invoice['customer_phone'], invoice_text)
+    return links[invoice['invoice_number']]
+
 def determine_payment_status(total_amount, paid_amount):
     """Determine payment status based on amounts"""
     if paid_amount >= total_amount:
@@ -507,9 +999,12 @@ def determine_payment_status(total_amount, paid_amount):
         return "غير مدفوعة"
 
 # Save invoice record to database
-def save_invoice_record(customer, cart_items, invoice_number, total_amount, paid_amount=None):
+def save_invoice_record(customer, cart_items, invoice_number, total_amount, paid_amount=None, issued_at=None):
     if paid_amount is None:
         paid_amount = total_amount
+    if issued_at is None:
+        issued_at = datetime.now()
+    issued_date = issued_at.date().isoformat()
     
     unpaid_amount = max(0, total_amount - paid_amount)
     status = determine_payment_status(total_amount, paid_amount)
@@ -522,8 +1017,8 @@ def save_invoice_record(customer, cart_items, invoice_number, total_amount, paid
         'paid_amount': float(paid_amount),
         'unpaid_amount': float(unpaid_amount),
         'status': status,
-        'date': datetime.now().date().isoformat(),
-        'billing_date': datetime.now().date().isoformat(),
+        'date': issued_date,
+        'billing_date': issued_date,
         'created_by': st.session_state.current_user,
         'salesman': st.session_state.current_user
     }
@@ -547,6 +1042,39 @@ def save_invoice_record(customer, cart_items, invoice_number, total_amount, paid
     
     return invoice_record
 
+def create_cart_invoice(customer, paid_amount):
+    """Save the cart as an invoice and return (invoice_number, whatsapp_link).
+    
+    Returns None if there is nothing left to save because this cart's invoice was already created.
+    """
+    cart = st.session_state.cart
+    if not cart:
+        return None
+    if st.session_state.pending_issued_at is None:
+        st.session_state.pending_issued_at = datetime.now()
+    # One timestamp, fixed when the cart started, shared by the invoice number, text and record
+    issued_at = st.session_state.pending_issued_at
+    invoice_number = f"INV-{issued_at:%Y%m%d%H%M%S}"
+    if invoice_number in st.session_state.saved_invoices:
+        clear_cart()  # Saved on an earlier attempt that failed afterwards
+        return None
+    
+    # Generate WhatsApp formatted invoice text with caching
+    cart_items_str = dumps_json(cart)  # For caching
+    invoice_text, amount = generate_whatsapp_invoice_text(
+        customer['name'], customer['phone'], cart_items_str, invoice_number, paid_amount, issued_at
+    )
+    if not save_invoice_record(customer, cart, invoice_number, amount, paid_amount, issued_at):
+        raise RuntimeError("Failed to create invoice")
+    # Recorded before anything else can fail, so a retry cannot insert the invoice again
+    st.session_state.saved_invoices.add(invoice_number)
+    
+    # Keep the link in session so later reruns serve it from memory
+    whatsapp_link = create_whatsapp_link(customer['phone'], invoice_text)
+    st.session_state.whatsapp_links[invoice_number] = whatsapp_link
+    clear_cart()
+    return invoice_number, whatsapp_link
+
 # Optimized filtering functions
 def filter_items(items, search_term, search_fields):
     """Generic filtering function with case-insensitive search"""
@@ -567,35 +1095,65 @@ def filter_items(items, search_term, search_fields):
     
     return filtered
 
+def summarize_invoices(invoices):
+    """Compute sales, paid and unpaid totals in a single pass over invoices"""
+    total_sales = total_paid = total_unpaid = 0
+    for inv in invoices:
+        total_sales += inv['total_amount']
+        total_paid += inv['paid_amount']
+        total_unpaid += inv['unpaid_amount']
+    return total_sales, total_paid, total_unpaid, len(invoices)
+
+def parse_invoice_dates(dates):
+    """Parse invoice date strings to naive day Timestamps; unparseable dates become NaT"""
+    # Rows mix "YYYY-MM-DD" (app, CSV) with full isoformat() timestamps (db.ipynb import), possibly with an offset;
+    # every shape starts with the local calendar day, so keep that instead of shifting offsets to UTC
+    day_part = dates.astype('string').str.slice(0, 10)
+    return pd.to_datetime(day_part, format='%Y-%m-%d', errors='coerce')
+
+def invoice_status_icon(status):
+    """Map an invoice payment status to its display icon"""
+    return "✅" if status.startswith('مدفوعة') else "❌" if status == 'غير مدفوعة' else "⚠️"
+
+# Amount columns stay numeric (sortable, no per-row string formatting) and are formatted by the frontend
+MONEY_COLUMN_CONFIG = {
+    column: st.column_config.NumberColumn(format="$%.2f")
+    for column in ('Total', 'Paid', 'Unpaid')
+}
+
 # Paginated display function
-def display_paginated_items(items, page_size=MAX_DISPLAY_ITEMS):
+def go_to_page(page_key, page, selection_key=None):
+    """Button callback that moves a paginated list to another page (keeps fragment reruns local)"""
+    st.session_state[page_key] = page
+    if selection_key:
+        # A selected row index would point at a different item on the new page
+        st.session_state.pop(selection_key, None)
+
+def display_paginated_items(items, page_size=MAX_DISPLAY_ITEMS, key="items", selection_key=None):
     """Display items with pagination"""
     if len(items) <= page_size:
         return items, 1, 1
     
-    # Get page number from session state
-    page_key = f"page_{id(items)}"
-    if page_key not in st.session_state:
-        st.session_state[page_key] = 1
-    
+    # Page number lives under a stable key; id(items) changed on every rerun and reset the page
+    page_key = f"page_{key}"
     total_pages = (len(items) - 1) // page_size + 1
-    current_page = st.session_state[page_key]
+    # Clamp in case filtering shrank the list since the page was chosen
+    current_page = min(st.session_state.get(page_key, 1), total_pages)
+    st.session_state[page_key] = current_page
     
     # Page navigation
     col1, col2, col3 = st.columns([1, 2, 1])
     
     with col1:
-        if st.button("◀ Previous", key=f"prev_{page_key}", disabled=(current_page <= 1)):
-            st.session_state[page_key] = max(1, current_page - 1)
-            st.rerun()
+        st.button("◀ Previous", key=f"prev_{page_key}", disabled=(current_page <= 1),
+                  on_click=go_to_page, args=(page_key, current_page - 1, selection_key))
     
     with col2:
         st.write(f"Page {current_page} of {total_pages} ({len(items)} items)")
     
     with col3:
-        if st.button("Next ▶", key=f"next_{page_key}", disabled=(current_page >= total_pages)):
-            st.session_state[page_key] = min(total_pages, current_page + 1)
-            st.rerun()
+        st.button("Next ▶", key=f"next_{page_key}", disabled=(current_page >= total_pages),
+                  on_click=go_to_page, args=(page_key, current_page + 1, selection_key))
     
     # Calculate slice indices
     start_idx = (current_page - 1) * page_size
@@ -641,10 +1199,7 @@ def admin_panel():
                 if submitted:
                     if new_username and new_password and new_name:
                         # Check if username already exists
-                        salesmen = db.get_salesmen()
-                        existing_user = next((s for s in salesmen if s['username'] == new_username), None)
-                        
-                        if existing_user:
+                        if new_username in db.get_salesmen_by_username():
                             st.error("Username already exists!")
                         else:
                             new_salesman = {
@@ -657,8 +1212,7 @@ def admin_panel():
                             }
                             result = db.add_salesman(new_salesman)
                             if result:
-                                st.success(f"Salesman '{new_name}' added successfully!")
-                                time.sleep(1)
+                                flash(f"Salesman '{new_name}' added successfully!")
                                 st.rerun()
                             else:
                                 st.error("Failed to add salesman")
@@ -670,41 +1224,38 @@ def admin_panel():
         salesmen = db.get_salesmen()
         
         if salesmen:
-            paginated_salesmen, current_page, total_pages = display_paginated_items(salesmen, 10)
+            # One table for all salesmen; actions are only rendered for the selected row
+            selection = st.dataframe(db.get_salesman_rows(), use_container_width=True, hide_index=True,
+                                     on_select="rerun", selection_mode="single-row",
+                                     key="salesmen_table")
+            selected_rows = [row for row in selection.selection.rows if row < len(salesmen)]
             
-            for salesman in paginated_salesmen:
-                with st.container():
-                    col1, col2, col3, col4, col5 = st.columns([2, 2, 1, 1, 1])
+            if not selected_rows:
+                st.caption("Select a salesman to activate, deactivate or delete them.")
+            else:
+                salesman = salesmen[selected_rows[0]]
+                
+                if salesman['username'] == 'admin':
+                    st.caption("The default admin account cannot be changed.")
+                else:
+                    col1, col2 = st.columns(2)
                     
                     with col1:
-                        st.write(f"**{salesman['name']}**")
-                        st.caption(f"Username: {salesman['username']}")
+                        action = "Deactivate" if salesman['active'] else "Activate"
+                        if st.button(f"{action} {salesman['name']}", key=f"salesman_toggle_{salesman['id']}"):
+                            updates = {'active': not salesman['active']}
+                            if db.update_salesman(salesman['id'], updates):
+                                # The refetched list may be reordered, so the selected row index is stale
+                                st.session_state.pop("salesmen_table", None)
+                                st.rerun()
                     
                     with col2:
-                        st.write(f"Role: {salesman['role'].title()}")
-                        created_date = datetime.fromisoformat(salesman['created_date']).strftime('%Y-%m-%d')
-                        st.caption(f"Created: {created_date}")
-                    
-                    with col3:
-                        status = "🟢 Active" if salesman['active'] else "🔴 Inactive"
-                        st.write(status)
-                    
-                    with col4:
-                        if salesman['username'] != 'admin':
-                            action = "Deactivate" if salesman['active'] else "Activate"
-                            if st.button(action, key=f"salesman_toggle_{salesman['id']}"):
-                                updates = {'active': not salesman['active']}
-                                if db.update_salesman(salesman['id'], updates):
-                                    st.rerun()
-                    
-                    with col5:
-                        if salesman['username'] != 'admin':
-                            if st.button("🗑️", key=f"salesman_delete_{salesman['id']}"):
-                                if db.delete_salesman(salesman['id']):
-                                    st.success(f"Deleted {salesman['name']}")
-                                    st.rerun()
-                    
-                    st.divider()
+                        if st.button(f"🗑️ Delete {salesman['name']}", key=f"salesman_delete_{salesman['id']}"):
+                            if db.delete_salesman(salesman['id']):
+                                flash(f"Deleted {salesman['name']}")
+                                # Rows below the deleted one shift up, so drop the stale selection
+                                st.session_state.pop("salesmen_table", None)
+                                st.rerun()
         else:
             st.info("No salesmen found.")
     
@@ -726,16 +1277,17 @@ def admin_panel():
             if uploaded_file is not None:
                 # Preview uploaded data
                 try:
-                    preview_df = pd.read_csv(uploaded_file)
+                    preview_df, invalid_prices = parse_products_csv(uploaded_file.getvalue())
                     st.subheader("Preview of uploaded data:")
                     st.dataframe(preview_df.head(), use_container_width=True)
+                    if not invalid_prices.empty:
+                        st.warning(describe_invalid_prices(invalid_prices))
                     
                     if st.button("Import Products to Database", type="primary"):
                         with st.spinner("Importing products..."):
                             success, message = load_products_from_csv(uploaded_file=uploaded_file)
                             if success:
-                                st.success(message)
-                                time.sleep(1)
+                                flash(message)
                                 st.rerun()
                             else:
                                 st.error(message)
@@ -761,11 +1313,7 @@ def admin_panel():
                 if submitted:
                     if new_product_name and new_product_price:
                         # Check if product already exists
-                        existing_products = db.get_products(active_only=False)
-                        existing_product = next((p for p in existing_products 
-                                              if p['product'].lower() == new_product_name.lower()), None)
-                        
-                        if existing_product:
+                        if new_product_name.strip().lower() in db.get_product_name_index():
                             st.error("Product with this name already exists!")
                         else:
                             product_data = {
@@ -779,8 +1327,7 @@ def admin_panel():
                             
                             result = db.add_product(product_data)
                             if result:
-                                st.success(f"Product '{new_product_name}' added successfully!")
-                                time.sleep(1)
+                                flash(f"Product '{new_product_name}' added successfully!")
                                 st.rerun()
                             else:
                                 st.error("Failed to add product")
@@ -825,7 +1372,7 @@ def admin_panel():
                 
                 # Paginated products display
                 paginated_products, current_page, total_pages = display_paginated_items(
-                    sorted(filtered_products, key=lambda x: x['product']), 20
+                    sorted(filtered_products, key=lambda x: x['product']), 20, key="products"
                 )
                 
                 # Products table with actions (Fixed keys)
@@ -937,17 +1484,16 @@ def admin_panel():
         # Get invoices from database with caching
         invoices = db.get_invoices()
         
-        # Filter invoices by date range efficiently
-        filtered_invoices = [
-            invoice for invoice in invoices
-            if start_date <= datetime.fromisoformat(invoice['date']).date() <= end_date
-        ]
+        # Filter by date with one vectorized mask over the cached frame, whose rows line up with the invoice list
+        invoice_frame = db.get_invoice_frame()
+        in_range = invoice_frame['date'].between(pd.Timestamp(start_date), pd.Timestamp(end_date))
+        filtered_invoices = list(compress(invoices, in_range.to_numpy()))
         
         if filtered_invoices:
-            # Optimized calculations
-            total_sales = sum(inv['total_amount'] for inv in filtered_invoices)
-            total_paid = sum(inv['paid_amount'] for inv in filtered_invoices)
-            total_unpaid = sum(inv['unpaid_amount'] for inv in filtered_invoices)
+            # All three totals in one vectorized sum over the matching frame rows
+            total_sales, total_paid, total_unpaid = (
+                invoice_frame.loc[in_range, ['total_amount', 'paid_amount', 'unpaid_amount']].sum()
+            )
             total_invoices = len(filtered_invoices)
             avg_sale = total_sales / total_invoices if total_invoices > 0 else 0
             
@@ -965,27 +1511,26 @@ def admin_panel():
             # Display invoice details with pagination
             st.subheader("Invoice Details")
             
-            # Sort invoices by date (newest first)
-            sorted_invoices = sorted(filtered_invoices, key=lambda x: x['date'], reverse=True)
-            paginated_invoices, current_page, total_pages = display_paginated_items(sorted_invoices, 25)
+            # Already newest first: fetched ordered by date and new invoices are prepended to the cache
+            paginated_invoices, current_page, total_pages = display_paginated_items(filtered_invoices, 25, key="sales_report")
             
             # Create DataFrame for display
             df_invoices = pd.DataFrame([
                 {
                     'Invoice #': inv['invoice_number'],
                     'Date': inv['date'],
-                    'Customer': inv['customers']['name'],
-                    'Phone': inv['customers']['phone'],
-                    'Total': f"${inv['total_amount']:.2f}",
-                    'Paid': f"${inv['paid_amount']:.2f}",
-                    'Unpaid': f"${inv['unpaid_amount']:.2f}",
+                    'Customer': inv['customer_name'],
+                    'Phone': inv['customer_phone'],
+                    'Total': inv['total_amount'],
+                    'Paid': inv['paid_amount'],
+                    'Unpaid': inv['unpaid_amount'],
                     'Status': inv['status'],
                     'Salesman': inv['salesman']
                 }
                 for inv in paginated_invoices
             ])
             
-            st.dataframe(df_invoices, use_container_width=True)
+            st.dataframe(df_invoices, use_container_width=True, column_config=MONEY_COLUMN_CONFIG)
             
         else:
             st.info(f"No invoices found for the selected date range ({start_date} to {end_date})")
@@ -994,89 +1539,332 @@ def admin_panel():
     with admin_tab4:
         st.header("Analytics Dashboard")
         
-        # Get all invoices for analytics
-        all_invoices = db.get_invoices()
+        # Columnar invoice frame, rebuilt only when the invoices are refetched
+        df_analytics = db.get_invoice_frame()
         
-        if all_invoices:
+        if not df_analytics.empty:
             # Time-based analytics
             st.subheader("Sales Trends")
             
-            # Convert to DataFrame for easy analysis
-            df_analytics = pd.DataFrame([
-                {
-                    'date': datetime.fromisoformat(inv['date']).date(),
-                    'total_amount': inv['total_amount'],
-                    'paid_amount': inv['paid_amount'],
-                    'salesman': inv['salesman'],
-                    'status': inv['status']
-                }
-                for inv in all_invoices
-            ])
+            # Aggregates are reused across reruns until the invoices are refetched
+            analytics = db.get_invoice_analytics(pd.Timestamp(datetime.now().date() - timedelta(days=30)))
             
             # Daily sales trend (last 30 days)
-            recent_date = datetime.now().date() - timedelta(days=30)
-            recent_df = df_analytics[df_analytics['date'] >= recent_date]
-            
-            if not recent_df.empty:
-                daily_sales = recent_df.groupby('date')['total_amount'].sum().reset_index()
-                daily_sales['date'] = pd.to_datetime(daily_sales['date'])
-                
+            if not analytics['daily_sales'].empty:
                 # Simple line chart using Streamlit
-                st.line_chart(daily_sales.set_index('date')['total_amount'])
+                st.line_chart(analytics['daily_sales'])
             
             # Top performers
             col1, col2 = st.columns(2)
             
             with col1:
                 st.subheader("Top Salesmen (Last 30 Days)")
-                salesman_performance = recent_df.groupby('salesman').agg({
-                    'total_amount': 'sum',
-                    'paid_amount': 'sum'
-                }).round(2).reset_index()
-                salesman_performance = salesman_performance.sort_values('total_amount', ascending=False)
-                st.dataframe(salesman_performance, use_container_width=True)
+                st.dataframe(analytics['salesman_performance'], use_container_width=True)
             
             with col2:
                 st.subheader("Payment Status Overview")
-                status_counts = df_analytics['status'].value_counts()
-                st.bar_chart(status_counts)
+                st.bar_chart(analytics['status_counts'])
             
             # Summary statistics
             st.subheader("Overall Statistics")
             col1, col2, col3, col4 = st.columns(4)
             
-            total_revenue = df_analytics['total_amount'].sum()
-            total_collected = df_analytics['paid_amount'].sum()
-            collection_rate = (total_collected / total_revenue * 100) if total_revenue > 0 else 0
-            avg_invoice = df_analytics['total_amount'].mean()
-            
             with col1:
-                st.metric("Total Revenue", f"${total_revenue:.2f}")
+                st.metric("Total Revenue", f"${analytics['total_revenue']:.2f}")
             with col2:
-                st.metric("Total Collected", f"${total_collected:.2f}")
+                st.metric("Total Collected", f"${analytics['total_collected']:.2f}")
             with col3:
-                st.metric("Collection Rate", f"{collection_rate:.1f}%")
+                st.metric("Collection Rate", f"{analytics['collection_rate']:.1f}%")
             with col4:
-                st.metric("Avg Invoice", f"${avg_invoice:.2f}")
+                st.metric("Avg Invoice", f"${analytics['avg_invoice']:.2f}")
         
         else:
             st.info("No data available for analytics.")
 
+# The cart runs as a fragment: editing, clearing and the payment form rerun only the cart
+@st.fragment
+def render_cart(selected_customer):
+    """Render the cart table, its total and the payment form for the selected customer"""
+    if st.session_state.cart:
+        st.subheader("Invoice Items")
+        
+        # Totals are kept across reruns and only recomputed when the cart changes
+        line_totals, total_amount = get_cart_totals()
+        
+        # Display cart as a single editable table instead of a widget row per item
+        cart_editor_key = f"cart_editor_{st.session_state.cart_version}"
+        st.data_editor(
+            [
+                {
+                    'Product': item['product'],
+                    'Price': item['price'],
+                    'Quantity': item['quantity'],
+                    'Total': line_total,
+                    'Remove': False
+                }
+                for item, line_total in zip(st.session_state.cart, line_totals)
+            ],
+            column_config={
+                'Price': st.column_config.NumberColumn(format="$%.2f"),
+                'Quantity': st.column_config.NumberColumn(min_value=1, step=1),
+                'Total': st.column_config.NumberColumn(format="$%.2f"),
+                'Remove': st.column_config.CheckboxColumn()
+            },
+            disabled=['Product', 'Price', 'Total'],
+            hide_index=True,
+            use_container_width=True,
+            key=cart_editor_key,
+            on_change=apply_cart_edits,
+            args=(cart_editor_key,)
+        )
+        
+        # Total
+        st.subheader(f"Total: ${total_amount:.2f}")
+        
+        # Generate invoice
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if st.button("🧾 Create Invoice", type="primary"):
+                st.session_state.show_payment_popup = True
+
+        with col2:
+            st.button("🗑️ Clear Cart", on_click=clear_cart)
+
+        # Payment popup (optimized)
+        if st.session_state.get('show_payment_popup', False):
+            with st.container():
+                st.markdown("### 💰 Set Payment Amount")
+                with st.form("payment_form"):
+                    col1, col2 = st.columns(2)
+                    
+                    with col1:
+                        st.write(f"**Total Amount: ${total_amount:.2f}**")
+                        paid_amount = st.number_input(
+                            "Amount Paid", 
+                            min_value=0.0, 
+                            max_value=float(total_amount), 
+                            value=float(total_amount),
+                            step=0.01,
+                            format="%.2f"
+                        )
+                    
+                    with col2:
+                        payment_status = determine_payment_status(total_amount, paid_amount)
+                        st.write(f"**Status:** {payment_status}")
+                        if paid_amount < total_amount:
+                            st.write(f"**Remaining:** ${total_amount - paid_amount:.2f}")
+                    
+                    col_confirm, col_cancel = st.columns(2)
+                    
+                    with col_confirm:
+                        confirm_create = st.form_submit_button("✅ Confirm & Create Invoice", type="primary")
+                    
+                    with col_cancel:
+                        st.form_submit_button("❌ Cancel", on_click=close_payment_popup)
+                    
+                    if confirm_create:
+                        try:
+                            with st.spinner("Creating invoice..."):
+                                created = create_cart_invoice(selected_customer, paid_amount)
+                            
+                            if created is None:
+                                st.info("This invoice was already created.")
+                            else:
+                                invoice_number, whatsapp_link = created
+                                flash(f"✅ Invoice {invoice_number} created successfully!")
+                                flash(f"💰 Payment Status: {payment_status}")
+                                st.session_state.last_invoice = {
+                                    'invoice_number': invoice_number,
+                                    'whatsapp_link': whatsapp_link
+                                }
+                                st.session_state.show_payment_popup = False
+                                st.rerun()
+                        
+                        except Exception as e:
+                            st.error(f"Error creating invoice: {str(e)}")
+    
+    else:
+        st.info("Cart is empty. Add some products to create an invoice.")
+
+
+# Invoice history runs as a fragment: its filters, paging and buttons rerun only this tab
+@st.fragment
+def render_invoice_history(is_admin):
+    """Render the invoice history tab with filters, the invoice table and the selected invoice"""
+    if is_admin:
+        st.header("All Invoices History")
+        invoices_created_by = None
+    else:
+        st.header("My Invoices")
+        invoices_created_by = st.session_state.current_user
+    invoices = db.get_invoices(created_by=invoices_created_by)
+    
+    if invoices:
+        # Summary is computed once per invoice fetch, not on every rerun
+        total_sales, total_paid, total_unpaid, total_count = db.get_invoice_summary(invoices_created_by)
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Total Sales", f"${total_sales:.2f}")
+        with col2:
+            st.metric("Total Paid", f"${total_paid:.2f}")
+        with col3:
+            st.metric("Total Unpaid", f"${total_unpaid:.2f}")
+        with col4:
+            st.metric("Total Invoices", total_count)
+        
+        st.divider()
+        
+        # Filters sit in a form so a status change and a search apply together in one rerun;
+        # the form keeps the last applied values across reruns
+        with st.form("history_filters"):
+            col1, col2 = st.columns(2)
+            with col1:
+                status_filter = st.selectbox("Filter by Status", 
+                                           ["All", "مدفوعة", "غير مدفوعة", "مدفوعة جزئياً"])
+            with col2:
+                search_invoice = st.text_input("🔍 Search invoices", 
+                                             placeholder="Search by customer name or invoice number...")
+            st.form_submit_button("Apply Filters", on_click=clear_invoice_history_selection)
+        
+        # Apply filters; text search runs against keys built once per invoice fetch
+        status_filter = None if status_filter == "All" else status_filter
+        if search_invoice:
+            filtered_invoices = db.search_invoices(search_invoice, status_filter, invoices_created_by)
+        elif status_filter:
+            filtered_invoices = [inv for inv in invoices if status_filter in inv['status']]
+        else:
+            filtered_invoices = invoices
+        
+        # Paginate invoices, already newest first from the query order and cache prepends
+        paginated_invoices, current_page, total_pages = display_paginated_items(filtered_invoices, 25, key="invoice_history",
+                                                                                selection_key="invoice_history_table")
+        
+        # Fetch items for the whole page in one query
+        items_by_invoice = db.get_invoice_items_bulk([inv['id'] for inv in paginated_invoices])
+        
+        # Render the page as a single table instead of one expander per invoice
+        df_history = pd.DataFrame([
+            {
+                'Status': inv['status_icon'],
+                'Invoice #': inv['invoice_number'],
+                'Date': inv['date'],
+                'Customer': inv['customer_name'],
+                'Total': inv['total_amount'],
+                'Paid': inv['paid_amount'],
+                'Unpaid': inv['unpaid_amount'],
+                'Items': sum(item['quantity'] for item in items_by_invoice.get(inv['id'], [])),
+                'Salesman': inv['salesman']
+            }
+            for inv in paginated_invoices
+        ])
+        if not is_admin and not df_history.empty:
+            df_history = df_history.drop(columns=['Salesman'])
+        
+        selection = st.dataframe(df_history, use_container_width=True, hide_index=True,
+                                 column_config=MONEY_COLUMN_CONFIG, on_select="rerun", selection_mode="single-row",
+                                 key="invoice_history_table")
+        selected_rows = [row for row in selection.selection.rows if row < len(paginated_invoices)]
+        
+        if not selected_rows:
+            st.caption("Select an invoice to view its items and actions.")
+        else:
+            # Only the selected invoice gets the detail widgets
+            invoice = paginated_invoices[selected_rows[0]]
+            status_icon = invoice['status_icon']
+            invoice_items = items_by_invoice.get(invoice['id'], [])
+            
+            # Escape user-entered fields once per invoice before they reach markdown
+            safe_customer_name = escape_markdown(invoice['customer_name'])
+            safe_customer_phone = escape_markdown(invoice['customer_phone'])
+            item_totals, _ = cart_line_totals(invoice_items)
+            items_markdown = "\n".join(
+                f"- {escape_markdown(item['product'])}: {item['quantity']} × \\${item['price']:.2f} = \\${line_total:.2f}"
+                for item, line_total in zip(invoice_items, item_totals)
+            )
+            
+            with st.expander(f"{status_icon} Invoice {invoice['invoice_number']} - {safe_customer_name} - \\${invoice['total_amount']:.2f}", expanded=True):
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    # One markdown element for all invoice fields; "$" is escaped since several share a block
+                    detail_lines = [
+                        f"**Customer:** {safe_customer_name}",
+                        f"**Phone:** {safe_customer_phone}",
+                        f"**Date:** {invoice['date']}",
+                        f"**Total:** \\${invoice['total_amount']:.2f}",
+                        f"**Paid:** \\${invoice['paid_amount']:.2f}",
+                        f"**Unpaid:** \\${invoice['unpaid_amount']:.2f}",
+                        f"**Status:** {invoice['status']}"
+                    ]
+                    if is_admin:
+                        detail_lines.append(f"**Salesman:** {escape_markdown(invoice['salesman'])}")
+                    st.markdown("  \n".join(detail_lines))
+                
+                with col2:
+                    # One markdown element for the whole item list
+                    st.markdown(f"**Items:**\n\n{items_markdown}")
+                
+                # One resend button for every invoice; delete only with permission
+                can_delete = is_admin or invoice['owner'] == st.session_state.current_user
+                col_resend, col_delete = st.columns(2)
+                
+                with col_resend:
+                    if st.button(f"📱 Resend via WhatsApp", key=f"resend_{invoice['invoice_number']}"):
+                        whatsapp_link = invoice_whatsapp_link(invoice, invoice_items)
+                        st.markdown(f"[📱 Open WhatsApp]({whatsapp_link})")
+                
+                if can_delete:
+                    with col_delete:
+                        delete_key = f"invoice_delete_{invoice['invoice_number']}"
+                        confirm_key = f"confirm_invoice_delete_{invoice['invoice_number']}"
+                        
+                        if st.button(f"🗑️ Delete Invoice", key=delete_key, type="secondary"):
+                            if st.session_state.get(confirm_key, False):
+                                with st.spinner("Deleting invoice..."):
+                                    if db.delete_invoice(invoice['invoice_number']):
+                                        flash(f"Invoice {invoice['invoice_number']} deleted successfully!")
+                                        # Clear confirmation state and the now stale row selection
+                                        if confirm_key in st.session_state:
+                                            del st.session_state[confirm_key]
+                                        st.session_state.pop("invoice_history_table", None)
+                                        st.rerun()
+                                    else:
+                                        st.error("Failed to delete invoice")
+                            else:
+                                # The confirmation warning below picks this up in the same run
+                                st.session_state[confirm_key] = True
+                        
+                        # Show confirmation message
+                        if st.session_state.get(confirm_key, False):
+                            st.warning("⚠️ Click Delete Invoice again to confirm deletion")
+    else:
+        if is_admin:
+            st.info("No invoices created yet.")
+        else:
+            st.info("You haven't created any invoices yet.")
+
+
 # Main app logic (Optimized)
 def main_app():
+    # Role is checked once per run and reused by every tab
+    is_admin = st.session_state.user_role == 'admin'
+    
+    # Fetch the tables every tab needs concurrently instead of one by one
+    db.prefetch(created_by=None if is_admin else st.session_state.current_user)
+    
     # Header with user info and logout button
     col1, col2, col3 = st.columns([3, 1, 1])
     with col1:
         st.title("🧾 Invoice Management System")
         if st.session_state.current_user:
-            salesmen = db.get_salesmen()
-            current_user_info = next((s for s in salesmen 
-                                    if s['username'] == st.session_state.current_user), None)
+            current_user_info = db.get_salesmen_by_username().get(st.session_state.current_user)
             if current_user_info:
                 st.caption(f"Logged in as: {current_user_info['name']} ({st.session_state.user_role.title()})")
     
     with col2:
-        if st.session_state.user_role == 'admin':
+        if is_admin:
             if st.button("👑 Admin Panel"):
                 st.session_state.show_admin = not st.session_state.get('show_admin', False)
                 st.rerun()
@@ -1089,12 +1877,15 @@ def main_app():
             init_session_state()
             st.rerun()
     
+    # Messages queued by the action that triggered the last rerun
+    show_flash_messages()
+    
     # Show admin panel if admin and requested
-    if st.session_state.user_role == 'admin' and st.session_state.get('show_admin', False):
+    if is_admin and st.session_state.get('show_admin', False):
         admin_panel()
     else:
         # Regular app tabs
-        if st.session_state.user_role == 'admin':
+        if is_admin:
             tab1, tab2, tab3 = st.tabs(["👥 Add Customer", "🛒 Create Invoice", "📋 Invoice History"])
         else:
             tab1, tab2, tab3 = st.tabs(["👥 Add Customer", "🛒 Create Invoice", "📋 My Invoices"])
@@ -1121,15 +1912,13 @@ def main_app():
                     if name and phone:
                         # Check if customer already exists
                         customers = db.get_customers()
-                        existing_customer = next((c for c in customers 
-                                                if c['name'].lower() == name.lower() or c['phone'] == phone), None)
+                        customer_names, customer_phones = db.get_customer_index()
                         
-                        if existing_customer:
+                        if name.lower() in customer_names or phone in customer_phones:
                             st.warning("Customer with this name or phone number already exists!")
                         else:
-                            # Get next ID
-                            customer_ids = [c['id'] for c in customers] if customers else [0]
-                            next_id = max(customer_ids) + 1
+                            # Get next ID without building a list of all ids
+                            next_id = max((c['id'] for c in customers), default=0) + 1
                             
                             customer = {
                                 'id': next_id,
@@ -1142,8 +1931,7 @@ def main_app():
                             }
                             result = db.add_customer(customer)
                             if result:
-                                st.success(f"Customer '{name}' added successfully!")
-                                time.sleep(1)
+                                flash(f"Customer '{name}' added successfully!")
                                 st.rerun()
                             else:
                                 st.error("Failed to add customer")
@@ -1158,21 +1946,13 @@ def main_app():
                 # Search functionality
                 search_term = st.text_input("🔍 Search customers", placeholder="Search by name or phone...")
                 
-                # Filter customers
-                filtered_customers = filter_items(customers, search_term, ['name', 'phone']) if search_term else customers
+                # Filter customers against search keys built once per customer fetch
+                customer_rows = db.get_customer_rows()
+                filtered_ids = db.search_customers(search_term) if search_term else customer_rows
                 
-                if filtered_customers:
-                    # Create DataFrame for display (no pagination)
-                    df_customers = pd.DataFrame([
-                        {
-                            'Name': c['name'],
-                            'Phone': c['phone'],
-                            'Email': c.get('email', ''),
-                            'Created': datetime.fromisoformat(c['created_date']).strftime('%Y-%m-%d')
-                        }
-                        for c in filtered_customers
-                    ])
-                    st.dataframe(df_customers, use_container_width=True)
+                if filtered_ids:
+                    # Rows are formatted once per customer fetch and passed as plain dicts (no pagination)
+                    st.dataframe([customer_rows[customer_id] for customer_id in filtered_ids], use_container_width=True)
                 else:
                     st.info("No customers found matching your search.")
         
@@ -1180,27 +1960,34 @@ def main_app():
         with tab2:
             st.header("Create Invoice")
             
+            # The last created invoice's link is kept in session and re-shown without regenerating it
+            last_invoice = st.session_state.last_invoice
+            if last_invoice:
+                st.markdown("### 📱 Send Invoice via WhatsApp")
+                st.markdown(f"**[📱 Send {last_invoice['invoice_number']} via WhatsApp]({last_invoice['whatsapp_link']})**")
+                st.caption("Click to open WhatsApp with the formatted invoice")
+                st.button("Dismiss", key="dismiss_last_invoice", on_click=dismiss_last_invoice)
+            
             # Load products from database with caching
             products = db.get_products()
             
             if not products:
                 st.warning("⚠️ No products found in database.")
                 
-                if st.session_state.user_role == 'admin':
+                if is_admin:
                     st.info("👑 Go to Admin Panel > Manage Products to add products.")
                 else:
                     st.info("Please contact your administrator to add products.")
                 
                 # File uploader for products (admin only)
-                if st.session_state.user_role == 'admin':
+                if is_admin:
                     st.markdown("### Quick Upload")
                     uploaded_file = st.file_uploader("Upload Products CSV", type=['csv'])
                     if uploaded_file is not None:
                         with st.spinner("Processing CSV..."):
                             success, message = load_products_from_csv(uploaded_file=uploaded_file)
                             if success:
-                                st.success(message)
-                                time.sleep(1)
+                                flash(message)
                                 st.rerun()
                             else:
                                 st.error(message)
@@ -1214,18 +2001,18 @@ def main_app():
                     st.subheader("Select Customer")
                     customer_search = st.text_input("🔍 Search customer", placeholder="Type name or phone...")
                     
-                    # Filter customers efficiently (no pagination)
-                    filtered_customers = filter_items(customers, customer_search, ['name', 'phone']) if customer_search else customers
+                    # Ids, labels and lookup dict are built once per customer fetch
+                    customer_ids, customer_labels, customers_by_id = db.get_customer_catalog()
+                    if customer_search:
+                        customer_ids = db.search_customers(customer_search)
                     
-                    if filtered_customers:
+                    if customer_ids:
                         # Show all filtered customers (no pagination limit)
-                        customer_options = [f"{c['name']} - {c['phone']}" for c in filtered_customers]
+                        selected_customer_id = st.selectbox("Select Customer", customer_ids,
+                                                            format_func=customer_labels.get)
+                        selected_customer = customers_by_id[selected_customer_id]
                         
-                        selected_customer_idx = st.selectbox("Select Customer", range(len(customer_options)), 
-                                                           format_func=lambda x: customer_options[x])
-                        selected_customer = filtered_customers[selected_customer_idx]
-                        
-                        st.info(f"Creating invoice for: {selected_customer['name']} ({selected_customer['phone']})")
+                        st.info(f"Creating invoice for: {escape_markdown(selected_customer['name'])} ({escape_markdown(selected_customer['phone'])})")
                         
                         # Optimized product selection
                         st.subheader("Add Products to Invoice")
@@ -1233,324 +2020,36 @@ def main_app():
                         # Search products with debouncing
                         product_search = st.text_input("🔍 Search products", placeholder="Search by name or category...")
                         
-                        # Filter products efficiently
-                        filtered_products = filter_items(products, product_search, ['product', 'category']) if product_search else products
+                        # Names, labels and lookup dict are built once per product fetch
+                        product_names, product_labels, products_by_name = db.get_product_catalog()
+                        if product_search:
+                            product_names = [p['product'] for p in filter_items(products, product_search, ['product', 'category'])]
                         
-                        if filtered_products:
-                            # Limit displayed products for performance
-                            display_products = filtered_products
-              
-                            
+                        if product_names:
                             col1, col2, col3 = st.columns([3, 1, 1])
                             
                             with col1:
-                                # Show product with category if available
-                                product_options = []
-                                for p in display_products:
-                                    display_name = f"{p['product']}"
-                                    if p.get('category'):
-                                        display_name += f" ({p['category']})"
-                                    product_options.append(display_name)
-                                
-                                selected_product_idx = st.selectbox("Select Product", range(len(product_options)), 
-                                                                   format_func=lambda x: product_options[x])
-                                selected_product_data = display_products[selected_product_idx]
+                                selected_product = st.selectbox("Select Product", product_names,
+                                                                format_func=product_labels.get, key="cart_product")
+                                selected_product_data = products_by_name[selected_product]
                             
                             with col2:
-                                quantity = st.number_input("Quantity", min_value=1, value=1)
+                                st.number_input("Quantity", min_value=1, value=1, key="cart_quantity")
                             
                             with col3:
                                 st.write(f"Price: ${selected_product_data['price']:.2f}")
-                                if st.button("Add to Cart"):
-                                    cart_item = {
-                                        'product': selected_product_data['product'],
-                                        'price': float(selected_product_data['price']),
-                                        'quantity': quantity
-                                    }
-                                    st.session_state.cart.append(cart_item)
-                                    st.success(f"Added {quantity}x {selected_product_data['product']} to cart")
-                                    st.rerun()
+                                st.button("Add to Cart", on_click=add_to_cart)
                         else:
                             st.info("No products found matching your search.")
                         
                         # Display cart with optimized rendering
-                        if st.session_state.cart:
-                            st.subheader("Invoice Items")
-                            
-                            # Display cart with remove option
-                            for i, item in enumerate(st.session_state.cart):
-                                col1, col2, col3, col4, col5 = st.columns([3, 1, 1, 1, 1])
-                                
-                                with col1:
-                                    st.text(item['product'])
-                                with col2:
-                                    st.text(f"${item['price']:.2f}")
-                                with col3:
-                                    st.text(str(item['quantity']))
-                                with col4:
-                                    st.text(f"${item['price'] * item['quantity']:.2f}")
-                                with col5:
-                                    if st.button("Remove", key=f"remove_{i}"):
-                                        st.session_state.cart.pop(i)
-                                        st.rerun()
-                            
-                            # Total
-                            total_amount = sum(item['price'] * item['quantity'] for item in st.session_state.cart)
-                            st.subheader(f"Total: ${total_amount:.2f}")
-                            
-                            # Generate invoice
-                            col1, col2 = st.columns(2)
-                            
-                            with col1:
-                                if st.button("🧾 Create Invoice", type="primary"):
-                                    st.session_state.show_payment_popup = True
-
-                            with col2:
-                                if st.button("🗑️ Clear Cart"):
-                                    st.session_state.cart = []
-                                    st.rerun()
-
-                            # Payment popup (optimized)
-                            if st.session_state.get('show_payment_popup', False):
-                                with st.container():
-                                    st.markdown("### 💰 Set Payment Amount")
-                                    with st.form("payment_form"):
-                                        col1, col2 = st.columns(2)
-                                        
-                                        with col1:
-                                            st.write(f"**Total Amount: ${total_amount:.2f}**")
-                                            paid_amount = st.number_input(
-                                                "Amount Paid", 
-                                                min_value=0.0, 
-                                                max_value=float(total_amount), 
-                                                value=float(total_amount),
-                                                step=0.01,
-                                                format="%.2f"
-                                            )
-                                        
-                                        with col2:
-                                            payment_status = determine_payment_status(total_amount, paid_amount)
-                                            st.write(f"**Status:** {payment_status}")
-                                            if paid_amount < total_amount:
-                                                st.write(f"**Remaining:** ${total_amount - paid_amount:.2f}")
-                                        
-                                        col_confirm, col_cancel = st.columns(2)
-                                        
-                                        with col_confirm:
-                                            confirm_create = st.form_submit_button("✅ Confirm & Create Invoice", type="primary")
-                                        
-                                        with col_cancel:
-                                            cancel_create = st.form_submit_button("❌ Cancel")
-                                        
-                                        if confirm_create:
-                                            invoice_number = f"INV-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                                            
-                                            try:
-                                                # Generate WhatsApp formatted invoice text with caching
-                                                cart_items_str = str(st.session_state.cart)  # For caching
-                                                invoice_text, amount = generate_whatsapp_invoice_text(
-                                                    selected_customer['name'], 
-                                                    selected_customer['phone'], 
-                                                    cart_items_str,
-                                                    invoice_number, 
-                                                    paid_amount
-                                                )
-                                                
-                                                # Save invoice record with payment info
-                                                with st.spinner("Creating invoice..."):
-                                                    invoice_record = save_invoice_record(selected_customer, st.session_state.cart, invoice_number, amount, paid_amount)
-                                                
-                                                if invoice_record:
-                                                    st.success(f"✅ Invoice {invoice_number} created successfully!")
-                                                    st.success(f"💰 Payment Status: {payment_status}")
-                                                    
-                                                    # WhatsApp sharing
-                                                    st.markdown("### 📱 Send Invoice via WhatsApp")
-                                                    whatsapp_link = create_whatsapp_link(selected_customer['phone'], invoice_text)
-                                                    st.markdown(f"**[📱 Send via WhatsApp]({whatsapp_link})**")
-                                                    st.caption("Click to open WhatsApp with the formatted invoice")
-                                                    
-                                                    # Clear cart and popup
-                                                    st.session_state.cart = []
-                                                    st.session_state.show_payment_popup = False
-                                                    time.sleep(1)
-                                                    st.rerun()
-                                                else:
-                                                    st.error("Failed to create invoice")
-                                                    
-                                            except Exception as e:
-                                                st.error(f"Error creating invoice: {str(e)}")
-                                        
-                                        elif cancel_create:
-                                            st.session_state.show_payment_popup = False
-                                            st.rerun()
-                        
-                        else:
-                            st.info("Cart is empty. Add some products to create an invoice.")
+                        render_cart(selected_customer)
                     else:
                         st.info("No customers found. Please add customers first.")
         
         # Tab 3: Invoice History (Optimized)
         with tab3:
-            if st.session_state.user_role == 'admin':
-                st.header("All Invoices History")
-                invoices = db.get_invoices()
-            else:
-                st.header("My Invoices")
-                invoices = db.get_invoices(created_by=st.session_state.current_user)
-            
-            if invoices:
-                # Optimized summary calculations
-                total_sales = sum(inv['total_amount'] for inv in invoices)
-                total_paid = sum(inv['paid_amount'] for inv in invoices)
-                total_unpaid = sum(inv['unpaid_amount'] for inv in invoices)
-                total_count = len(invoices)
-                
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("Total Sales", f"${total_sales:.2f}")
-                with col2:
-                    st.metric("Total Paid", f"${total_paid:.2f}")
-                with col3:
-                    st.metric("Total Unpaid", f"${total_unpaid:.2f}")
-                with col4:
-                    st.metric("Total Invoices", total_count)
-                
-                st.divider()
-                
-                # Optimized filter options
-                col1, col2 = st.columns(2)
-                with col1:
-                    status_filter = st.selectbox("Filter by Status", 
-                                               ["All", "مدفوعة", "غير مدفوعة", "مدفوعة جزئياً"])
-                with col2:
-                    search_invoice = st.text_input("🔍 Search invoices", 
-                                                 placeholder="Search by customer name or invoice number...")
-                
-                # Apply filters efficiently
-                filtered_invoices = invoices
-                if status_filter != "All":
-                    filtered_invoices = [inv for inv in filtered_invoices 
-                                      if status_filter in inv['status']]
-                
-                if search_invoice:
-                    filtered_invoices = filter_items(filtered_invoices, search_invoice, ['invoice_number'])
-                    # Also search customer names
-                    if not filtered_invoices:
-                        filtered_invoices = [inv for inv in invoices 
-                                          if search_invoice.lower() in inv['customers']['name'].lower()]
-                
-                # Sort and paginate invoices
-                sorted_invoices = sorted(filtered_invoices, key=lambda x: x['date'], reverse=True)
-                paginated_invoices, current_page, total_pages = display_paginated_items(sorted_invoices, 10)
-                
-                for invoice in paginated_invoices:
-                    status_icon = "✅" if invoice['status'].startswith('مدفوعة') else "❌" if invoice['status'] == 'غير مدفوعة' else "⚠️"
-                    
-                    with st.expander(f"{status_icon} Invoice {invoice['invoice_number']} - {invoice['customers']['name']} - ${invoice['total_amount']:.2f}"):
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            st.write(f"**Customer:** {invoice['customers']['name']}")
-                            st.write(f"**Phone:** {invoice['customers']['phone']}")
-                            st.write(f"**Date:** {invoice['date']}")
-                            st.write(f"**Total:** ${invoice['total_amount']:.2f}")
-                            st.write(f"**Paid:** ${invoice['paid_amount']:.2f}")
-                            st.write(f"**Unpaid:** ${invoice['unpaid_amount']:.2f}")
-                            st.write(f"**Status:** {invoice['status']}")
-                            if st.session_state.user_role == 'admin':
-                                st.write(f"**Salesman:** {invoice['salesman']}")
-                        
-                        with col2:
-                            st.write("**Items:**")
-                            # Get invoice items from database with caching
-                            invoice_items = db.get_invoice_items(invoice['id'])
-                            for item in invoice_items:
-                                st.write(f"- {item['product']}: {item['quantity']} × ${item['price']:.2f} = ${item['quantity'] * item['price']:.2f}")
-                        
-                        # Action buttons with permission check
-                        can_delete = (st.session_state.user_role == 'admin' or 
-                                     invoice['created_by'] == st.session_state.current_user or 
-                                     invoice['salesman'] == st.session_state.current_user)
-
-                        if can_delete:
-                            col_resend, col_delete = st.columns(2)
-                            
-                            with col_resend:
-                                if st.button(f"📱 Resend via WhatsApp", key=f"resend_{invoice['invoice_number']}"):
-                                    # Reconstruct cart items for WhatsApp message
-                                    cart_items = []
-                                    for item in invoice_items:
-                                        cart_items.append({
-                                            'product': item['product'],
-                                            'price': item['price'],
-                                            'quantity': item['quantity']
-                                        })
-                                    
-                                    # Use cached WhatsApp generation
-                                    cart_items_str = str(cart_items)
-                                    invoice_text, _ = generate_whatsapp_invoice_text(
-                                        invoice['customers']['name'], 
-                                        invoice['customers']['phone'], 
-                                        cart_items_str,
-                                        invoice['invoice_number'],
-                                        invoice['paid_amount']
-                                    )
-                                    whatsapp_link = create_whatsapp_link(invoice['customers']['phone'], invoice_text)
-                                    st.markdown(f"[📱 Open WhatsApp]({whatsapp_link})")
-                            
-                            with col_delete:
-                                delete_key = f"invoice_delete_{invoice['invoice_number']}"
-                                confirm_key = f"confirm_invoice_delete_{invoice['invoice_number']}"
-                                
-                                if st.button(f"🗑️ Delete Invoice", key=delete_key, type="secondary"):
-                                    if st.session_state.get(confirm_key, False):
-                                        with st.spinner("Deleting invoice..."):
-                                            if db.delete_invoice(invoice['invoice_number']):
-                                                st.success(f"Invoice {invoice['invoice_number']} deleted successfully!")
-                                                # Clear confirmation state
-                                                if confirm_key in st.session_state:
-                                                    del st.session_state[confirm_key]
-                                                time.sleep(1)
-                                                st.rerun()
-                                            else:
-                                                st.error("Failed to delete invoice")
-                                    else:
-                                        st.session_state[confirm_key] = True
-                                        st.rerun()
-                                
-                                # Show confirmation message
-                                if st.session_state.get(confirm_key, False):
-                                    st.warning("⚠️ Click Delete Invoice again to confirm deletion")
-                        else:
-                            # Resend only for non-deletable invoices
-                            if st.button(f"📱 Resend via WhatsApp", key=f"resend_readonly_{invoice['invoice_number']}"):
-                                # Reconstruct cart items for WhatsApp message
-                                cart_items = []
-                                invoice_items = db.get_invoice_items(invoice['id'])
-                                for item in invoice_items:
-                                    cart_items.append({
-                                        'product': item['product'],
-                                        'price': item['price'],
-                                        'quantity': item['quantity']
-                                    })
-                                
-                                # Use cached WhatsApp generation
-                                cart_items_str = str(cart_items)
-                                invoice_text, _ = generate_whatsapp_invoice_text(
-                                    invoice['customers']['name'], 
-                                    invoice['customers']['phone'], 
-                                    cart_items_str,
-                                    invoice['invoice_number'],
-                                    invoice['paid_amount']
-                                )
-                                whatsapp_link = create_whatsapp_link(invoice['customers']['phone'], invoice_text)
-                                st.markdown(f"[📱 Open WhatsApp]({whatsapp_link})")
-            else:
-                if st.session_state.user_role == 'admin':
-                    st.info("No invoices created yet.")
-                else:
-                    st.info("You haven't created any invoices yet.")
+            render_invoice_history(is_admin)
         
         # Footer
         st.markdown("---")
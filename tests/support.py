@@ -0,0 +1,21 @@
+"""Import app.py for tests without Streamlit secrets or a Supabase connection."""
+import importlib
+import sys
+from pathlib import Path
+from unittest import mock
+
+import streamlit as st
+import supabase
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+
+def load_app():
+    """Import (or re-import) the app module with a fake Supabase client."""
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    secrets = {'SUPABASE_URL': 'http://localhost', 'SUPABASE_KEY': 'test-key'}
+    with mock.patch.object(st, 'secrets', secrets), \
+            mock.patch.object(supabase, 'create_client', return_value=mock.MagicMock()):
+        sys.modules.pop('app', None)
+        return importlib.import_module('app')
@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+from support import load_app
+
+
+class SessionState(dict):
+    """Dict with attribute access, like st.session_state"""
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+
+class CreateCartInvoiceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+
+    def setUp(self):
+        self.customer = {'id': 1, 'name': 'Shop', 'phone': '+961 70 000 000'}
+        self.state = SessionState(cart=[], cart_version=0, pending_issued_at=None, saved_invoices=set(),
+                                  whatsapp_links={}, flash_messages=[], cart_product='Pen', cart_quantity=2)
+        catalog = ([], [], {'Pen': {'product': 'Pen', 'price': 1.5}})
+        patches = [
+            mock.patch.object(self.app.st, 'session_state', self.state),
+            mock.patch.object(self.app.db, 'get_product_catalog', return_value=catalog),
+            mock.patch.object(self.app, 'save_invoice_record', return_value={'id': 1}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.app.add_to_cart()
+
+    def test_second_submit_does_not_save_again(self):
+        invoice_number, whatsapp_link = self.app.create_cart_invoice(self.customer, 3.0)
+        self.assertIsNone(self.app.create_cart_invoice(self.customer, 3.0))
+        self.app.save_invoice_record.assert_called_once()
+        self.assertIn(invoice_number, self.state.saved_invoices)
+        self.assertTrue(whatsapp_link.startswith('https://wa.me/96170000000?'))
+        self.assertIsNone(self.state.pending_issued_at)
+
+    def test_retry_after_a_failure_past_the_save(self):
+        with mock.patch.object(self.app, 'create_whatsapp_link', side_effect=RuntimeError('link failed')):
+            with self.assertRaises(RuntimeError):
+                self.app.create_cart_invoice(self.customer, 3.0)
+        # The cart and its invoice number survived, but the invoice is not saved twice
+        self.assertTrue(self.state.cart)
+        self.assertIsNone(self.app.create_cart_invoice(self.customer, 3.0))
+        self.app.save_invoice_record.assert_called_once()
+        self.assertEqual(self.state.cart, [])
+
+    def test_invoice_number_is_fixed_when_the_cart_starts(self):
+        started_at = self.state.pending_issued_at
+        self.app.add_to_cart()
+        self.assertIs(self.state.pending_issued_at, started_at)
+        invoice_number, _ = self.app.create_cart_invoice(self.customer, 3.0)
+        self.assertEqual(invoice_number, f"INV-{started_at:%Y%m%d%H%M%S}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+import pandas as pd
+
+from support import load_app
+
+
+class ParseInvoiceDatesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+
+    def test_mixed_date_shapes(self):
+        for dates in (['2026-10-01', '2026-10-02T14:30:00'], ['2026-10-02T14:30:00', '2026-10-01']):
+            with self.subTest(dates=dates):
+                parsed = self.app.parse_invoice_dates(pd.Series(dates))
+                self.assertEqual(sorted(parsed), [pd.Timestamp('2026-10-01'), pd.Timestamp('2026-10-02')])
+
+    def test_offsets_are_made_naive(self):
+        parsed = self.app.parse_invoice_dates(pd.Series(['2026-10-02T10:00:00+03:00', '2026-10-01']))
+        self.assertIsNone(parsed.dt.tz)
+        self.assertEqual(list(parsed), [pd.Timestamp('2026-10-02'), pd.Timestamp('2026-10-01')])
+        # Comparable with the naive Timestamps the report tabs filter with
+        self.assertEqual(int((parsed >= pd.Timestamp('2026-10-02')).sum()), 1)
+
+    def test_offset_keeps_local_calendar_day(self):
+        # 01:30 at +03:00 is still the previous day in UTC
+        parsed = self.app.parse_invoice_dates(pd.Series(['2026-10-02T01:30:00+03:00', '2026-10-02T23:30:00-05:00']))
+        self.assertEqual(list(parsed), [pd.Timestamp('2026-10-02'), pd.Timestamp('2026-10-02')])
+
+    def test_unparseable_dates_become_nat(self):
+        parsed = self.app.parse_invoice_dates(pd.Series(['2026-10-01', 'not a date', None]))
+        self.assertEqual(parsed.isna().tolist(), [False, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import hashlib
+import unittest
+from unittest import mock
+
+from support import load_app
+
+
+class VerifyPasswordTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+
+    def test_round_trip(self):
+        stored = self.app.hash_password('secret')
+        self.assertTrue(self.app.verify_password(stored, 'secret'))
+        self.assertFalse(self.app.verify_password(stored, 'wrong'))
+        self.assertFalse(self.app.password_needs_rehash(stored))
+
+    def test_legacy_sha256(self):
+        stored = hashlib.sha256(b'secret').hexdigest()
+        self.assertTrue(self.app.verify_password(stored, 'secret'))
+        self.assertTrue(self.app.password_needs_rehash(stored))
+
+    def test_malformed_hashes_do_not_match(self):
+        scheme = self.app.PASSWORD_HASH_SCHEME
+        for stored in (f'{scheme}$', f'{scheme}$abc$salt$00', f'{scheme}$1$salt', f'{scheme}$1$a$b$c',
+                       'sha256-ü', None):
+            with self.subTest(stored=stored):
+                self.assertFalse(self.app.verify_password(stored, 'secret'))
+
+    def test_unknown_user_hash_uses_current_iterations(self):
+        self.assertFalse(self.app.password_needs_rehash(self.app.UNKNOWN_USER_PASSWORD_HASH))
+        with mock.patch.object(hashlib, 'pbkdf2_hmac', wraps=hashlib.pbkdf2_hmac) as pbkdf2:
+            self.assertFalse(self.app.verify_password(self.app.UNKNOWN_USER_PASSWORD_HASH, 'wrong'))
+        self.assertEqual(pbkdf2.call_args.args[3], self.app.PASSWORD_HASH_ITERATIONS)
+
+
+class AuthenticateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+
+    def authenticate(self, salesmen, username, password):
+        """Run authenticate against the given salesmen, spying on verify_password"""
+        db = mock.Mock()
+        db.get_salesmen_by_username.return_value = salesmen
+        with mock.patch.object(self.app, 'db', db), \
+                mock.patch.object(self.app, 'verify_password', wraps=self.app.verify_password) as verify:
+            return self.app.authenticate(username, password), verify, db
+
+    def test_unknown_user_checks_dummy_hash(self):
+        user, verify, _ = self.authenticate({}, 'nobody', 'secret')
+        self.assertIsNone(user)
+        verify.assert_called_once_with(self.app.UNKNOWN_USER_PASSWORD_HASH, 'secret')
+
+    def test_legacy_hash_is_upgraded_on_login(self):
+        salesman = {'id': 7, 'username': 'sam', 'password': hashlib.sha256(b'secret').hexdigest(), 'active': True}
+        user, _, db = self.authenticate({'sam': salesman}, 'sam', 'secret')
+        self.assertIs(user, salesman)
+        new_hash = db.update_salesman.call_args.args[1]['password']
+        self.assertFalse(self.app.password_needs_rehash(new_hash))
+
+    def test_inactive_user_is_rejected(self):
+        salesman = {'id': 7, 'username': 'sam', 'password': self.app.hash_password('secret'), 'active': False}
+        user, verify, db = self.authenticate({'sam': salesman}, 'sam', 'secret')
+        self.assertIsNone(user)
+        verify.assert_called_once_with(salesman['password'], 'secret')
+        db.update_salesman.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from support import load_app
+
+
+class ParseProductsCsvTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = load_app()
+
+    def test_bad_prices_are_reported_not_raised(self):
+        csv = 'product,price,category\nPen,1.5,office\nRuler,"12,5",office\nTape,N/A,\nGlue, 3 ,\nClip,,\n'
+        df, invalid_prices = self.app.parse_products_csv(csv.encode())
+        self.assertEqual(len(df), 5)
+        self.assertEqual(df['price'].tolist()[:1] + df['price'].tolist()[3:4], [1.5, 3.0])
+        self.assertEqual(invalid_prices['row'].tolist(), [2, 3])
+        self.assertEqual(invalid_prices['product'].tolist(), ['Ruler', 'Tape'])
+        self.assertEqual(invalid_prices['price'].tolist(), ['12,5', 'N/A'])
+        self.assertIn('2 row(s)', self.app.describe_invalid_prices(invalid_prices))
+
+    def test_rows_are_counted_past_blank_lines(self):
+        csv = 'product,price\nPen,1.5\n\nRuler,abc\n"Tape\nroll",N/A\n'
+        df, invalid_prices = self.app.parse_products_csv(csv.encode())
+        self.assertEqual(len(df), 3)
+        self.assertEqual(invalid_prices['row'].tolist(), [2, 3])
+        self.assertIn("row 2 ('abc'), row 3 ('N/A')", self.app.describe_invalid_prices(invalid_prices))
+
+    def test_all_numeric_prices(self):
+        df, invalid_prices = self.app.parse_products_csv('﻿product,price\nPen,2\n'.encode())
+        self.assertEqual(df['price'].tolist(), [2.0])
+        self.assertTrue(invalid_prices.empty)
+
+
+if __name__ == '__main__':
+    unittest.main()